@@ -1,4 +1,4 @@
-import math
+from . import kernels
 
 """
 The crucial idea in speeding up the brute force n-body algorithm is to group nearby bodies and approximate them as a 
@@ -13,88 +13,39 @@ class Quadtree:
     A quad-tree is similar to a binary tree, except that each node has 4 children (some of which may be empty).
     Each node represents a region of the two dimensional space.
     The topmost node represents the whole space, and its four children represent the four quadrants of the space.
-    The space is recursively subdivided into quadrants until each subdivision contains 0 or 1 bodies
-    (some regions do not have bodies in all of their quadrants)
-    """
-
-    nodes = []
+    The space is recursively subdivided into quadrants until each subdivision contains at most `leaf_size` bodies,
+    or bodies too close together to be separated (some regions do not have bodies in all of their quadrants)
 
-    sum_mass = 0.0
-    center_x = 0.0
-    center_y = 0.0
-    size = 0
+    The non-empty regions are stored as parallel arrays, the root region first: region `r` holds the nodes
+    `indices[first[r]:first[r] + count[r]]` and `children[k, r]` is its sub-region in the cardinal direction `k`
+    (NW, NE, SW, SE), or -1 if that quadrant is empty.
+    """
 
-    # Cardinal direction
+    __slots__ = ('nodes', 'indices', 'first', 'count', 'center_x', 'center_y', 'sum_mass', 'size2', 'children',
+                 'depth')
 
-    NW = None  # left top
-    NE = None  # right top
-    SW = None  # left bottom
-    SE = None  # right bottom
+    # Nodes in a leaf interact node to node, in batches long enough for SIMD
+    leaf_size = 16
 
     def __init__(self, nodes):
         self.nodes = nodes
-        self.compute()
-
-    def compute(self):
-        if len(self.nodes):
-            self.sum_mass = 0
-            sum_x = 0
-            sum_y = 0
-
-            for node in self.nodes:
-                # print(node.mass)
-                self.sum_mass += node.mass
-                sum_x += node.x * node.mass
-                sum_y += node.y * node.mass
-
-            self.center_x = sum_x / self.sum_mass
-            self.center_y = sum_y / self.sum_mass
-
-            size = float('-inf')
-            for n in self.nodes:
-                distance = math.sqrt(
-                    (n.x - self.center_x) * (n.x - self.center_x) + (n.y - self.center_y) * (
-                        n.y - self.center_y))
-                size = max(size, 2 * distance)
-
-            self.size = size
 
     def build(self):
-        if len(self.nodes) > 1:
-            NW = []
-            NE = []
-            SW = []
-            SE = []
-
-            for node in self.nodes:
-                if node.y > self.center_y:
-                    if node.x > self.center_x:
-                        NE.append(node)
-                    if node.x < self.center_x:
-                        NW.append(node)
-                else:
-                    if node.x > self.center_x:
-                        SW.append(node)
-                    if node.x < self.center_x:
-                        SE.append(node)
-
-            self.NW = Quadtree(NW)
-            self.NE = Quadtree(NE)
-            self.SW = Quadtree(SW)
-            self.SE = Quadtree(SE)
-
-            for reg in (self.NW, self.NE, self.SW, self.SE):
-                reg.build()
-
-    def apply_force(self, node, force, theta):
-        if len(self.nodes) > 1:
-            distance = math.sqrt(
-                (node.x - self.center_x) * (node.x - self.center_x) + (node.y - self.center_y) * (
-                    node.y - self.center_y))
-            if distance * theta > self.size:
-                force.apply_approximation(node, self)
-            else:
-                for reg in (self.NW, self.NE, self.SW, self.SE):
-                    reg.apply_force(node, force, theta)
-        if len(self.nodes) == 1:
-            force.apply_node_to_node(node, self.nodes[0])
+        (self.indices, self.first, self.count, self.center_x, self.center_y, self.sum_mass, self.size2,
+         self.children, self.depth) = kernels.build_quadtree(self.nodes.x, self.nodes.y, self.nodes.mass,
+                                                             self.leaf_size)
+
+    def apply_force(self, force, theta):
+        """
+        Apply the repulsion of this region to every node in it
+        """
+        if not len(self.count):
+            return
+        # Each visited region pushes at most 4 sub-regions and pops itself
+        stack_size = 3 * self.depth + 1
+        nodes = self.nodes
+        kernels.bh_apply(nodes.x, nodes.y, nodes.mass, nodes.size, nodes.dx, nodes.dy,
+                         nodes.x[self.indices], nodes.y[self.indices], nodes.mass[self.indices],
+                         nodes.size[self.indices], self.first, self.count, self.center_x, self.center_y,
+                         self.sum_mass, self.size2, self.children, theta, force.coefficient, force.adjust_by_size,
+                         stack_size)
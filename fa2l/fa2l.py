@@ -2,9 +2,10 @@ import numpy
 import random
 import math
 import networkx
-from .structures import Node, Edge
+from .structures import NodeArray, EdgeArray
 from .approximation import Quadtree
-from .force import apply_repulsion, apply_gravity, apply_attraction, get_repulsion, get_strong_gravity, get_attraction
+from .force import apply_repulsion, apply_gravity, apply_attraction, get_repulsion, get_strong_gravity, get_attraction, \
+    get_edge_weights
 
 
 def force_atlas2_layout(graph,
@@ -23,7 +24,7 @@ def force_atlas2_layout(graph,
 
                         scaling_ratio=2.0,
                         strong_gravity_mode=False,
-                        multithread=False,
+                        multithread=True,
                         gravity=1.0):
     """
     Position nodes using ForceAtlas2 force-directed algorithm
@@ -79,6 +80,7 @@ def force_atlas2_layout(graph,
         However, its advantage is to force a very compact layout, which may be useful for certain purposes.
 
     multithread: boolean
+        Compute the repulsion on all the threads of numba (NUMBA_NUM_THREADS) when it is installed, or on a single one.
 
     gravity: float
         Attracts nodes to the center. Prevents islands from drifting away.
@@ -92,9 +94,8 @@ def force_atlas2_layout(graph,
     assert isinstance(graph, networkx.classes.graph.Graph), "Not a networkx graph"
     assert isinstance(pos_list, dict) or (pos_list is None), "pos must be specified as a dictionary, as in networkx"
 
-    assert multithread is False, "Not implemented yet"
-
-    G = numpy.asarray(networkx.to_numpy_matrix(graph))
+    G = networkx.to_scipy_sparse_array(graph, format='csr', dtype=numpy.float64)
+    G.eliminate_zeros()
 
     pos = None
 
@@ -107,7 +108,8 @@ def force_atlas2_layout(graph,
         masses = numpy.asarray([node_masses[node] for node in graph.nodes()])
 
     assert G.shape == (G.shape[0], G.shape[0]), "G is not 2D square"
-    assert numpy.all(G.T == G), "G is not symmetric."
+    # The adjacency of an undirected graph is symmetric by construction, only a DiGraph can fail this O(nnz) test
+    assert not graph.is_directed() or (G != G.T).nnz == 0, "G is not symmetric."
 
     # speed and speed efficiency describe a scaling factor of dx and dy
     # before x and y are adjusted.  These are modified as the
@@ -115,34 +117,26 @@ def force_atlas2_layout(graph,
     speed = 1
     speed_efficiency = 1
 
-    nodes = []
-    for i in range(0, G.shape[0]):
-        n = Node()
-        if node_masses is None:
-            n.mass = 1 + numpy.count_nonzero(G[i])
-        else:
-            n.mass = masses[i]
-        n.old_dx = 0
-        n.old_dy = 0
-        n.dx = 0
-        n.dy = 0
-        if pos is None:
-            n.x = random.random()
-            n.y = random.random()
-        else:
-            n.x = pos[i][0]
-            n.y = pos[i][1]
-        nodes.append(n)
-
-    edges = []
-    es = numpy.asarray(G.nonzero()).T
-    for e in es:
-        if e[1] <= e[0]: continue  # Avoid duplicate edges
-        edge = Edge()
-        edge.node1 = e[0]  # The index of the first node in `nodes`
-        edge.node2 = e[1]  # The index of the second node in `nodes`
-        edge.weight = G[tuple(e)]
-        edges.append(edge)
+    n = G.shape[0]
+    nodes = NodeArray(n)
+    if node_masses is None:
+        nodes.mass[:] = 1 + numpy.diff(G.indptr)  # Number of neighbours
+    else:
+        nodes.mass[:] = masses
+    if pos is None:
+        for i in range(0, n):
+            nodes.x[i] = random.random()
+            nodes.y[i] = random.random()
+    else:
+        nodes.x[:] = pos[:, 0]
+        nodes.y[:] = pos[:, 1]
+
+    G = G.tocoo()
+    upper = G.col > G.row  # Avoid duplicate edges
+    edges = EdgeArray(numpy.count_nonzero(upper))
+    edges.node1[:] = G.row[upper]
+    edges.node2[:] = G.col[upper]
+    edges.weight[:] = G.data[upper]
 
     repulsion = get_repulsion(prevent_overlapping, scaling_ratio)
 
@@ -152,19 +146,26 @@ def force_atlas2_layout(graph,
         gravity_force = repulsion
 
     if outbound_attraction_distribution:
-        outbound_att_compensation = numpy.mean([n.mass for n in nodes])
+        outbound_att_compensation = nodes.mass.mean()
 
     attraction_coef = outbound_att_compensation if outbound_attraction_distribution else 1
     attraction = get_attraction(lin_log_mode, outbound_attraction_distribution, prevent_overlapping,
                                 attraction_coef)
+    edge_weight = get_edge_weights(edges, edge_weight_influence)
+    attraction.prepare(nodes, edges, edge_weight)
+    # Per-node swinging and traction, and a pair of scratch arrays, reused by every iteration
+    swinging = numpy.empty(n, dtype=nodes.x.dtype)
+    traction = numpy.empty(n, dtype=nodes.x.dtype)
+    buffer_x = numpy.empty(n, dtype=nodes.x.dtype)
+    buffer_y = numpy.empty(n, dtype=nodes.x.dtype)
+
     # Main loop
 
     for _i in range(0, iterations):
-        for n in nodes:
-            n.old_dx = n.dx
-            n.old_dy = n.dy
-            n.dx = 0
-            n.dy = 0
+        nodes.old_dx[:] = nodes.dx
+        nodes.old_dy[:] = nodes.dy
+        nodes.dx.fill(0)
+        nodes.dy.fill(0)
 
         # Barnes Hut optimization
         root_region = None
@@ -174,70 +175,67 @@ def force_atlas2_layout(graph,
             root_region.build()
 
         apply_repulsion(repulsion, nodes, barnes_hut_optimize=barnes_hut_optimize, barnes_hut_theta=barnes_hut_theta,
-                        region=root_region)
+                        region=root_region, multithread=multithread)
         apply_gravity(gravity_force, nodes, gravity, scaling_ratio)
 
-        apply_attraction(attraction, nodes, edges, edge_weight_influence)
+        apply_attraction(attraction, nodes, edges, edge_weight)
 
         # Auto adjust speed.
-        total_swinging = 0.0  # How much irregular movement
-        total_effective_traction = 0.0  # How much useful movement
-        for n in nodes:
-            swinging = math.sqrt((n.old_dx - n.dx) * (n.old_dx - n.dx) + (n.old_dy - n.dy) * (n.old_dy - n.dy))
-            total_swinging += n.mass * swinging
-            total_effective_traction += .5 * n.mass * math.sqrt(
-                (n.old_dx + n.dx) * (n.old_dx + n.dx) + (n.old_dy + n.dy) * (n.old_dy + n.dy))
+        # How much irregular movement
+        numpy.subtract(nodes.old_dx, nodes.dx, out=buffer_x)
+        numpy.subtract(nodes.old_dy, nodes.dy, out=buffer_y)
+        numpy.hypot(buffer_x, buffer_y, out=swinging)
+        total_swinging = numpy.einsum('i,i->', nodes.mass, swinging)
+        # How much useful movement
+        numpy.add(nodes.old_dx, nodes.dx, out=buffer_x)
+        numpy.add(nodes.old_dy, nodes.dy, out=buffer_y)
+        numpy.hypot(buffer_x, buffer_y, out=traction)
+        total_effective_traction = .5 * numpy.einsum('i,i->', nodes.mass, traction)
 
         # Optimize jitter tolerance.
         # The 'right' jitter tolerance for this network.
         # Bigger networks need more tolerance. Denser networks need less tolerance.
         # Totally empiric.
 
-        estimated_optimal_jitter_tolerance = .05 * math.sqrt(len(nodes))
+        estimated_optimal_jitter_tolerance = .05 * math.sqrt(n)
         min_jt = math.sqrt(estimated_optimal_jitter_tolerance)
         max_jt = 10
         jt = jitter_tolerance * max(min_jt, min(max_jt, estimated_optimal_jitter_tolerance * total_effective_traction /
-                                                (len(nodes) ** 2)))
+                                                (n ** 2)))
 
         min_speed_efficiency = 0.05
 
-        # Protective against erratic behavior
-        if total_swinging / total_effective_traction > 2.0:
-            if speed_efficiency > min_speed_efficiency:
-                speed_efficiency *= .5
-            jt = max(jt, jitter_tolerance)
+        # No swinging (e.g. a lone node, or no force changed since the last iteration): there is nothing to
+        # adapt the speed to, and the target speed below would divide by zero. Keep the current speed.
+        if total_swinging > 0:
+            # Protective against erratic behavior
+            if total_swinging > 2.0 * total_effective_traction:
+                if speed_efficiency > min_speed_efficiency:
+                    speed_efficiency *= .5
+                jt = max(jt, jitter_tolerance)
 
-        target_speed = jt * speed_efficiency * total_effective_traction / total_swinging
+            target_speed = jt * speed_efficiency * total_effective_traction / total_swinging
 
-        if total_swinging > jt * total_effective_traction:
-            if speed_efficiency > min_speed_efficiency:
-                speed_efficiency *= .7
-        elif speed < 1000:
-            speed_efficiency *= 1.3
+            if total_swinging > jt * total_effective_traction:
+                if speed_efficiency > min_speed_efficiency:
+                    speed_efficiency *= .7
+            elif speed < 1000:
+                speed_efficiency *= 1.3
 
-        # But the speed shoudn't rise too much too quickly, since it would
-        # make the convergence drop dramatically.
-        max_rise = .5
-        speed = speed + min(target_speed - speed, max_rise * speed)
+            # But the speed shoudn't rise too much too quickly, since it would
+            # make the convergence drop dramatically.
+            max_rise = .5
+            speed = speed + min(target_speed - speed, max_rise * speed)
 
         # Apply forces.
         if prevent_overlapping:
-            for n in nodes:
-                swinging = n.mass * math.sqrt(
-                    (n.old_dx - n.dx) * (n.old_dx - n.dx) + (n.old_dy - n.dy) * (n.old_dy - n.dy))
-                factor = 0.1 * speed / (1 + math.sqrt(speed * swinging))
-
-                df = math.sqrt(math.pow(n.dx, 2) + n.dy ** 2)
-                factor = min(factor * df, 10.) / df
+            factor = 0.1 * speed / (1 + numpy.sqrt(speed * nodes.mass * swinging))
 
-                x = n.dx * factor
-                y = n.dy * factor
+            df = numpy.hypot(nodes.dx, nodes.dy)
+            factor = numpy.divide(numpy.minimum(factor * df, 10.), df, out=numpy.zeros(n), where=df > 0)
         else:
-            for n in nodes:
-                swinging = n.mass * math.sqrt(
-                    (n.old_dx - n.dx) * (n.old_dx - n.dx) + (n.old_dy - n.dy) * (n.old_dy - n.dy))
-                factor = speed / (1.0 + math.sqrt(speed * swinging))
-                n.x = n.x + (n.dx * factor)
-                n.y = n.y + (n.dy * factor)
-    positions = [(n.x, n.y) for n in nodes]
+            factor = speed / (1.0 + numpy.sqrt(speed * nodes.mass * swinging))
+        nodes.x += nodes.dx * factor
+        nodes.y += nodes.dy * factor
+    positions = [(float(x), float(y)) for x, y in zip(nodes.x, nodes.y)]
     return dict(zip(graph.nodes(), positions))
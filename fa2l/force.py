@@ -1,38 +1,44 @@
-import math
+import numpy
+import scipy.sparse
+from . import kernels
 
 
-def apply_repulsion(repulsion, nodes, barnes_hut_optimize=False, region=None, barnes_hut_theta=1.2):
+def apply_repulsion(repulsion, nodes, barnes_hut_optimize=False, region=None, barnes_hut_theta=1.2,
+                    multithread=True):
     """
-    Iterate through the nodes or edges and apply the forces directly to the node objects.
+    Iterate through the nodes or edges and apply the forces directly to the node arrays.
+    Each node only accumulates its own repulsion, so the compiled kernels run over the nodes in parallel.
     """
-    if not barnes_hut_optimize:
-        for i in range(0, len(nodes)):
-            for j in range(0, i):
-                repulsion.apply_node_to_node(nodes[i], nodes[j])
-    else:
-        for i in range(0, len(nodes)):
-            region.apply_force(nodes[i], repulsion, barnes_hut_theta)
+    with kernels.threads(multithread):
+        if not barnes_hut_optimize:
+            repulsion.apply_all(nodes)
+        else:
+            region.apply_force(repulsion, barnes_hut_theta)
 
 
 def apply_gravity(repulsion, nodes, gravity, scaling_ratio):
     """
-    Iterate through the nodes or edges and apply the gravity directly to the node objects.
+    Apply the gravity of every node at once, directly to the node arrays.
     """
-    for i in range(0, len(nodes)):
-        repulsion.apply_gravitation(nodes[i], gravity / scaling_ratio)
+    repulsion.apply_gravitation_all(nodes, gravity / scaling_ratio)
+
 
+def apply_attraction(attraction, nodes, edges, edge_weight):
+    attraction.apply_all(nodes, edges, edge_weight)
 
-def apply_attraction(attraction, nodes, edges, edge_weight_influence):
+
+def get_edge_weights(edges, edge_weight_influence):
+    """
+    Weights the attraction works with: the edge weights raised to the power `edge_weight_influence`.
+    They do not change during the layout, so compute them once.
+    """
     # Optimization, since usually edgeWeightInfluence is 0 or 1, and pow is slow
     if edge_weight_influence == 0:
-        for edge in edges:
-            attraction.apply(nodes[edge.node1], nodes[edge.node2], 1)
+        return numpy.ones(len(edges))
     elif edge_weight_influence == 1:
-        for edge in edges:
-            attraction.apply(nodes[edge.node1], nodes[edge.node2], edge.weight)
+        return edges.weight
     else:
-        for edge in edges:
-            attraction.apply(nodes[edge.node1], nodes[edge.node2], pow(edge.weight, edge_weight_influence))
+        return numpy.power(edges.weight, edge_weight_influence)
 
 
 def get_repulsion(adjust_by_size, coefficient):
@@ -80,41 +86,149 @@ class AttractionForce:
     def __str__(self):
         return str(self.__class__)
 
-    def apply(self, node1, node2, edge_weight):
+    def prepare(self, nodes, edges, edge_weight):
+        """
+        Precompute whatever does not change during the layout. Called once before the first `apply_all`.
+        """
+        pass
+
+    def apply_all(self, nodes, edges, edge_weight):
         """
-        Model for node-node attraction.
-        This will adjust the dx and dy values of `node1` (and optionally `node2`).
+        Model for node-node attraction along every edge at once, `edge_weight` holding one weight per edge
         """
         raise NotImplementedError
 
 
+def _edge_distances(nodes, edges):
+    """
+    Coordinate differences between the two ends of every edge
+    """
+    return nodes.x[edges.node1] - nodes.x[edges.node2], nodes.y[edges.node1] - nodes.y[edges.node2]
+
+
+def _edge_matrix(nodes, edges, factor):
+    """
+    Symmetric sparse matrix S holding `factor` for both directions of every edge, and its row sums.
+    A linear attraction of factor S[i, j] along every edge moves node i by (S x)[i] - sum_j S[i, j] * x[i].
+    """
+    n = len(nodes)
+    matrix = scipy.sparse.coo_matrix((numpy.concatenate((factor, factor)),
+                                      (numpy.concatenate((edges.node1, edges.node2)),
+                                       numpy.concatenate((edges.node2, edges.node1)))), shape=(n, n)).tocsr()
+    return matrix, numpy.asarray(matrix.sum(axis=1)).ravel()
+
+
+def _linear_gravitation(nodes, coefficient):
+    """
+    Gravity of strength coefficient * mass towards the origin, see LinearRepulsion
+    """
+    distance = numpy.hypot(nodes.x, nodes.y)
+    factor = numpy.divide(coefficient * nodes.mass, distance, out=numpy.zeros(len(nodes)), where=distance > 0)
+    nodes.dx -= nodes.x * factor
+    nodes.dy -= nodes.y * factor
+
+
+def _scatter(nodes, edges, x_force, y_force):
+    """
+    Add the per-edge forces to the first node of every edge and subtract them from the second one
+    """
+    n = len(nodes)
+    nodes.dx += numpy.bincount(edges.node1, x_force, n) - numpy.bincount(edges.node2, x_force, n)
+    nodes.dy += numpy.bincount(edges.node1, y_force, n) - numpy.bincount(edges.node2, y_force, n)
+
+
 class RepulsionForce:
     """
     Here are all the formulas for attraction and repulsion.
     """
 
+    # Whether node sizes are taken into account (Barnes Hut kernel)
+    adjust_by_size = False
+
+    # Side of the tiles of `apply_all` without compiled kernels
+    tile_size = 256
+
+    # Number of nodes above which the exact repulsion runs on the CUDA device, when cupy is installed
+    gpu_threshold = 2000
+
     def __init__(self, coefficient):
         self.coefficient = coefficient
+        # Work matrices of `apply_all` without compiled kernels, kept between iterations
+        self.buffers = None
+        # coefficient * mass of every node for the tiles of `apply_all`, computed on first use
+        self.coefficient_mass = None
 
     def __str__(self):
         return str(self.__class__)
 
-    def apply_node_to_node(self, node1, node2):
+    def apply_all(self, nodes):
         """
-        Model for node-node repulsion
+        Node-node repulsion between every pair of nodes at once: on the CUDA device for large graphs, with the
+        compiled kernel, or with numpy tiles whose factors come from `_tile_factors`
         """
-        raise NotImplementedError
-
-    @staticmethod
-    def apply_approximation(self, node, region):
+        if len(nodes) > self.gpu_threshold and kernels.gpu_available():
+            kernels.gpu_pairwise_repulsion(nodes.x, nodes.y, nodes.mass, nodes.size, nodes.dx, nodes.dy,
+                                           self.coefficient, self.adjust_by_size)
+            return
+        if kernels.compiled:
+            # A coefficient of the same precision as the nodes keeps the kernel in single precision
+            kernels.pairwise_repulsion(nodes.x, nodes.y, nodes.mass, nodes.size, nodes.dx, nodes.dy,
+                                       nodes.x.dtype.type(self.coefficient), self.adjust_by_size)
+            return
+
+        self._apply_tiled(nodes)
+
+    def apply_gravitation_all(self, nodes, gravity):
         """
-        Model for Barnes Hut approximation
+        Model for gravitation (anti-repulsion) of every node at once
         """
         raise NotImplementedError
 
-    def apply_gravitation(self, node, gravity):
+    def _apply_tiled(self, nodes):
+        """
+        Exact repulsion with numpy, computed on tiles of `tile_size` x `tile_size` pairs so that the work
+        matrices stay in cache. Forces are antisymmetric, so only the tiles on and below the diagonal are
+        computed: a tile below it adds its row sums to its rows and subtracts its column sums from its columns.
+        Single precision halves the memory traffic; the work matrices are allocated once and then reused.
         """
-        Model for gravitation (anti-repulsion)
+        if self.buffers is None:
+            self.buffers = tuple(numpy.empty((self.tile_size, self.tile_size), dtype=numpy.float32)
+                                 for _ in range(4)) + (numpy.empty((self.tile_size, self.tile_size), dtype=bool),)
+
+        if self.coefficient_mass is None:
+            # Masses are static: the tiles multiply coefficient * mass[i] by mass[j], which saves multiplying
+            # every pair by the coefficient on every iteration
+            self.coefficient_mass = self.coefficient * nodes.mass
+        coefficient_mass, mass, size = self.coefficient_mass, nodes.mass, nodes.size
+        x, y = nodes.x, nodes.y
+
+        n = len(nodes)
+        for i0 in range(0, n, self.tile_size):
+            i1 = min(i0 + self.tile_size, n)
+            for j0 in range(0, i0 + 1, self.tile_size):
+                j1 = min(j0 + self.tile_size, n)
+                x_dist, y_dist, distance2, factor, mask = (buffer[:i1 - i0, :j1 - j0] for buffer in self.buffers)
+
+                numpy.subtract.outer(x[i0:i1], x[j0:j1], out=x_dist)
+                numpy.subtract.outer(y[i0:i1], y[j0:j1], out=y_dist)
+                numpy.multiply(x_dist, x_dist, out=distance2)
+                numpy.multiply(y_dist, y_dist, out=factor)
+                distance2 += factor  # Distance squared
+                numpy.multiply.outer(coefficient_mass[i0:i1], mass[j0:j1], out=factor)
+
+                self._tile_factors(distance2, factor, mask, size[i0:i1], size[j0:j1])
+
+                x_dist *= factor
+                y_dist *= factor
+                nodes.dx[i0:i1] += x_dist.sum(axis=1)
+                nodes.dy[i0:i1] += y_dist.sum(axis=1)
+                if j0 != i0:
+                    nodes.dx[j0:j1] -= x_dist.sum(axis=0)
+                    nodes.dy[j0:j1] -= y_dist.sum(axis=0)
+
+    def _tile_factors(self, distance2, factor, mask, size1, size2):
+        """
+        Turn the products coefficient * mass1 * mass2 in `factor` into force / distance, given the squared distances
         """
         raise NotImplementedError
 
@@ -130,39 +244,15 @@ class LinearRepulsion(RepulsionForce):
     def __str__(self):
         return RepulsionForce.__str__(self)
 
-    def apply_node_to_node(self, node1, node2):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-        distance2 = x_dist * x_dist + y_dist * y_dist  # Distance squared
-
-        if distance2 > 0:
-            factor = self.coefficient * node1.mass * node2.mass / distance2
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
-
-    def apply_approximation(self, node, region):
-        x_dist = node.x - region.center_x
-        y_dist = node.y - region.center_y
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2)
-
-        if distance > 0:
-            # NB: factor = force / distance
-            factor = self.coefficient * node.mass * region.sum_mass / distance / distance
+    def _tile_factors(self, distance2, factor, mask, size1, size2):
+        # Skip the node itself and coincident nodes
+        numpy.equal(distance2, 0, out=mask)
+        numpy.copyto(distance2, numpy.inf, where=mask)
 
-            node.dx += x_dist * factor
-            node.dy += y_dist * factor
+        factor /= distance2
 
-    def apply_gravitation(self, node, gravity):
-        x_dist = node.x
-        y_dist = node.y
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2)
-
-        if distance > 0:
-            factor = self.coefficient * node.mass * gravity / distance
-            node.dx -= x_dist * factor
-            node.dy -= y_dist * factor
+    def apply_gravitation_all(self, nodes, gravity):
+        _linear_gravitation(nodes, self.coefficient * gravity)
 
 
 class LinRepulsionAntiCollision(RepulsionForce):
@@ -170,59 +260,29 @@ class LinRepulsionAntiCollision(RepulsionForce):
     Repulsion force: Strong Gravity (as a Repulsion Force because it is easier)
     """
 
+    adjust_by_size = True
+
     def __init__(self, *args, **kwargs):
         RepulsionForce.__init__(self, *args, **kwargs)
 
     def __str__(self):
         return RepulsionForce.__str__(self)
 
-    def apply_node_to_node(self, node1, node2):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2) - node1.size - node2.size
-
-        if distance > 0:
-            factor = self.coefficient * node1.mass * node2.mass / distance / distance
-
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
-
-        if distance < 0:
-            factor = 100 * self.coefficient * node1.mass * node2.mass
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
-
-    def apply_approximation(self, node, region):
-        x_dist = node.x - region.center_x
-        y_dist = node.y - region.center_y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2)
-        if distance > 0:
-            factor = self.coefficient * node.mass * region.sum_mass / distance / distance
+    def _tile_factors(self, distance, factor, mask, size1, size2):
+        numpy.sqrt(distance, out=distance)
+        distance -= size1[:, None]
+        distance -= size2[None, :]
 
-            node.dx += x_dist * factor
-            node.dy += y_dist * factor
-        if distance < 0:
-            factor = -self.coefficient * node.mass * region.sum_mass / distance
+        numpy.greater(distance, 0, out=mask)
+        numpy.divide(factor, distance, out=factor, where=mask)
+        numpy.divide(factor, distance, out=factor, where=mask)
+        numpy.less(distance, 0, out=mask)
+        numpy.multiply(factor, 100, out=factor, where=mask)
+        numpy.equal(distance, 0, out=mask)
+        numpy.copyto(factor, 0, where=mask)
 
-            node.dx += x_dist * factor
-            node.dy += y_dist * factor
-
-    def apply_gravitation(self, node, gravity):
-        x_dist = node.x
-        y_dist = node.y
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2)
-
-        if distance > 0:
-            factor = self.coefficient * node.mass * gravity / distance
-            node.dx -= x_dist * factor
-            node.dy -= y_dist * factor
+    def apply_gravitation_all(self, nodes, gravity):
+        _linear_gravitation(nodes, self.coefficient * gravity)
 
 
 class StrongGravity(RepulsionForce):
@@ -236,29 +296,17 @@ class StrongGravity(RepulsionForce):
     def __str__(self):
         return RepulsionForce.__str__(self)
 
-    def apply_node_to_node(self, node1, node2):
+    def apply_all(self, nodes):
         """
         Not Relevant
         """
         pass
 
-    @staticmethod
-    def apply_approximation(self, node, region):
-        """
-        Not Relevant
-        """
-        pass
-
-    def apply_gravitation(self, node, gravity):
-        x_dist = node.x
-        y_dist = node.y
-
-        distance = math.sqrt(x_dist * x_dist + y_dist * y_dist)
-        if distance > 0:
-            # NB: factor = force / distance
-            factor = self.coefficient * node.mass * gravity
-            node.dx -= x_dist * factor
-            node.dy -= y_dist * factor
+    def apply_gravitation_all(self, nodes, gravity):
+        # A node at the origin gets x = y = 0 times a finite factor: no need to skip it
+        factor = self.coefficient * gravity * nodes.mass
+        nodes.dx -= nodes.x * factor
+        nodes.dy -= nodes.y * factor
 
 
 class LinAttraction(AttractionForce):
@@ -268,16 +316,12 @@ class LinAttraction(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-        factor = -self.coefficient * edge_weight
-
-        node1.dx += x_dist * factor
-        node1.dy += y_dist * factor
+    def prepare(self, nodes, edges, edge_weight):
+        self.matrix, self.degree = _edge_matrix(nodes, edges, self.coefficient * edge_weight)
 
-        node2.dx -= x_dist * factor
-        node2.dy -= y_dist * factor
+    def apply_all(self, nodes, edges, edge_weight):
+        nodes.dx += self.matrix.dot(nodes.x) - self.degree * nodes.x
+        nodes.dy += self.matrix.dot(nodes.y) - self.degree * nodes.y
 
 
 class LinAttractionMassDistributed(AttractionForce):
@@ -291,17 +335,13 @@ class LinAttractionMassDistributed(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
+    def prepare(self, nodes, edges, edge_weight):
+        self.matrix, self.degree = _edge_matrix(nodes, edges,
+                                                self.coefficient * edge_weight / nodes.weight[edges.node1])
 
-        factor = -self.coefficient * edge_weight / node1.weight
-
-        node1.dx += x_dist * factor
-        node1.dy += y_dist * factor
-
-        node2.dx -= x_dist * factor
-        node2.dy -= y_dist * factor
+    def apply_all(self, nodes, edges, edge_weight):
+        nodes.dx += self.matrix.dot(nodes.x) - self.degree * nodes.x
+        nodes.dy += self.matrix.dot(nodes.y) - self.degree * nodes.y
 
 
 class LinAttractionAntiCollision(AttractionForce):
@@ -315,20 +355,12 @@ class LinAttractionAntiCollision(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2) - node1.size - node2.size
-
-        if distance > 0:
-            factor = -self.coefficient * edge_weight
-
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
+    def apply_all(self, nodes, edges, edge_weight):
+        x_dist, y_dist = _edge_distances(nodes, edges)
+        distance = numpy.hypot(x_dist, y_dist) - nodes.size[edges.node1] - nodes.size[edges.node2]
 
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
+        factor = numpy.where(distance > 0, -self.coefficient * edge_weight, 0)
+        _scatter(nodes, edges, x_dist * factor, y_dist * factor)
 
 
 class LinAttractionDegreeDistributedAntiCollision(AttractionForce):
@@ -342,20 +374,12 @@ class LinAttractionDegreeDistributedAntiCollision(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
+    def apply_all(self, nodes, edges, edge_weight):
+        x_dist, y_dist = _edge_distances(nodes, edges)
+        distance = numpy.hypot(x_dist, y_dist) - nodes.size[edges.node1] - nodes.size[edges.node2]
 
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2) - node1.size - node2.size
-
-        if distance > 0:
-            factor = -self.coefficient * edge_weight / node1.mass
-
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
+        factor = numpy.where(distance > 0, -self.coefficient * edge_weight / nodes.mass[edges.node1], 0)
+        _scatter(nodes, edges, x_dist * factor, y_dist * factor)
 
 
 class LogAttraction(AttractionForce):
@@ -369,19 +393,13 @@ class LogAttraction(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2)
-        if distance > 0:
-            factor = -self.coefficient * edge_weight * math.log(1 + distance) / distance
+    def apply_all(self, nodes, edges, edge_weight):
+        x_dist, y_dist = _edge_distances(nodes, edges)
+        distance = numpy.hypot(x_dist, y_dist)
 
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            factor = numpy.where(distance > 0, -self.coefficient * edge_weight * numpy.log1p(distance) / distance, 0)
+        _scatter(nodes, edges, x_dist * factor, y_dist * factor)
 
 
 class LogAttractionDegreeDistributed(AttractionForce):
@@ -395,20 +413,14 @@ class LogAttractionDegreeDistributed(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2)
-
-        if distance > 0:
-            factor = -self.coefficient * edge_weight * math.log(1 + distance) / distance / node1.mass
+    def apply_all(self, nodes, edges, edge_weight):
+        x_dist, y_dist = _edge_distances(nodes, edges)
+        distance = numpy.hypot(x_dist, y_dist)
 
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            factor = numpy.where(distance > 0, -self.coefficient * edge_weight * numpy.log1p(distance) /
+                                 (distance * nodes.mass[edges.node1]), 0)
+        _scatter(nodes, edges, x_dist * factor, y_dist * factor)
 
 
 class LogAttractionAntiCollision(AttractionForce):
@@ -422,20 +434,13 @@ class LogAttractionAntiCollision(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2) - node1.size - node2.size
+    def apply_all(self, nodes, edges, edge_weight):
+        x_dist, y_dist = _edge_distances(nodes, edges)
+        distance = numpy.hypot(x_dist, y_dist) - nodes.size[edges.node1] - nodes.size[edges.node2]
 
-        if distance > 0:
-            factor = -self.coefficient * edge_weight * math.log(1 + distance) / distance
-
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
-
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            factor = numpy.where(distance > 0, -self.coefficient * edge_weight * numpy.log1p(distance) / distance, 0)
+        _scatter(nodes, edges, x_dist * factor, y_dist * factor)
 
 
 class LogAttractionDegreeDistributedAntiCollision(AttractionForce):
@@ -449,16 +454,11 @@ class LogAttractionDegreeDistributedAntiCollision(AttractionForce):
     def __str__(self):
         return AttractionForce.__str__(self)
 
-    def apply(self, node1, node2, edge_weight):
-        x_dist = node1.x - node2.x
-        y_dist = node1.y - node2.y
-
-        distance = math.sqrt(x_dist ** 2 + y_dist ** 2) - node1.size - node2.size
-
-        if distance > 0:
-            factor = -self.coefficient * edge_weight * math.log(1 + distance) / distance / node1.mass
-            node1.dx += x_dist * factor
-            node1.dy += y_dist * factor
+    def apply_all(self, nodes, edges, edge_weight):
+        x_dist, y_dist = _edge_distances(nodes, edges)
+        distance = numpy.hypot(x_dist, y_dist) - nodes.size[edges.node1] - nodes.size[edges.node2]
 
-            node2.dx -= x_dist * factor
-            node2.dy -= y_dist * factor
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            factor = numpy.where(distance > 0, -self.coefficient * edge_weight * numpy.log1p(distance) /
+                                 (distance * nodes.mass[edges.node1]), 0)
+        _scatter(nodes, edges, x_dist * factor, y_dist * factor)
@@ -0,0 +1,329 @@
+"""
+Compiled loops of the layout. They are compiled with numba when it is installed and run as plain Python otherwise.
+"""
+import contextlib
+from math import sqrt as _sqrt
+import numpy
+
+try:
+    import numba
+except ImportError:  # numba is optional: without it the kernels below run as plain Python
+    numba = None
+
+try:
+    import cupy
+except ImportError:  # cupy is optional: without it the exact repulsion of large graphs stays on the CPU
+    cupy = None
+
+# Whether the kernels are compiled. Loops that numpy vectorizes well only go through them when they are.
+compiled = numba is not None and not numba.config.DISABLE_JIT
+
+
+def jit(parallel=False):
+    def decorator(function):
+        if numba is None:
+            return function
+        return numba.njit(parallel=parallel, fastmath=True, cache=True)(function)
+
+    return decorator
+
+
+prange = range if numba is None else numba.prange
+
+
+@contextlib.contextmanager
+def threads(multithread):
+    """
+    Run the parallel kernels on all the threads of numba (NUMBA_NUM_THREADS), or on a single one
+    """
+    if multithread or not compiled:
+        yield
+        return
+    previous = numba.get_num_threads()
+    numba.set_num_threads(1)
+    try:
+        yield
+    finally:
+        numba.set_num_threads(previous)
+
+
+@jit()
+def _node_to_node(x_dist, y_dist, mass1, mass2, size1, size2, coefficient, adjust_by_size):
+    """
+    Repulsion factor (force / distance) between two nodes, see LinearRepulsion and LinRepulsionAntiCollision.
+    The constants are single precision so that single precision inputs are not promoted to double.
+    """
+    distance2 = x_dist * x_dist + y_dist * y_dist
+    if adjust_by_size:
+        distance = _sqrt(distance2) - size1 - size2
+        if distance > 0:
+            return coefficient * mass1 * mass2 / (distance * distance)
+        elif distance < 0:
+            return numpy.float32(100) * coefficient * mass1 * mass2
+        return numpy.float32(0)
+    elif distance2 > 0:
+        return coefficient * mass1 * mass2 / distance2
+    return numpy.float32(0)
+
+
+@jit(parallel=True)
+def pairwise_repulsion(x, y, mass, node_size, dx, dy, coefficient, adjust_by_size):
+    """
+    Exact repulsion between every pair of nodes, without any n x n temporary.
+    Each node only accumulates its own forces, so the outer loop runs in parallel.
+    """
+    for n in prange(x.shape[0]):
+        fx = x.dtype.type(0)
+        fy = x.dtype.type(0)
+        for other in range(x.shape[0]):
+            if other == n:
+                continue
+            x_dist = x[n] - x[other]
+            y_dist = y[n] - y[other]
+            factor = _node_to_node(x_dist, y_dist, mass[n], mass[other], node_size[n], node_size[other],
+                                   coefficient, adjust_by_size)
+            fx += x_dist * factor
+            fy += y_dist * factor
+        dx[n] += fx
+        dy[n] += fy
+
+
+_GPU_SOURCE = r"""
+extern "C" __global__
+void pairwise_repulsion(const float* x, const float* y, const float* mass, const float* node_size,
+                        float* dx, float* dy, int n, float coefficient, int adjust_by_size)
+{
+    // Standard n-body blocking: the block loads the other nodes tile by tile into shared memory
+    extern __shared__ float tile[];
+    float* tile_x = tile;
+    float* tile_y = tile + blockDim.x;
+    float* tile_mass = tile + 2 * blockDim.x;
+    float* tile_size = tile + 3 * blockDim.x;
+
+    int i = blockIdx.x * blockDim.x + threadIdx.x;
+    float xi = i < n ? x[i] : 0.f;
+    float yi = i < n ? y[i] : 0.f;
+    float mi = i < n ? mass[i] : 0.f;
+    float si = i < n ? node_size[i] : 0.f;
+    float fx = 0.f;
+    float fy = 0.f;
+    for (int start = 0; start < n; start += blockDim.x) {
+        int j = start + threadIdx.x;
+        if (j < n) {
+            tile_x[threadIdx.x] = x[j];
+            tile_y[threadIdx.x] = y[j];
+            tile_mass[threadIdx.x] = mass[j];
+            tile_size[threadIdx.x] = node_size[j];
+        }
+        __syncthreads();
+        int stop = min((int) blockDim.x, n - start);
+        for (int k = 0; k < stop; k++) {
+            if (start + k == i) {
+                continue;
+            }
+            float x_dist = xi - tile_x[k];
+            float y_dist = yi - tile_y[k];
+            float distance2 = x_dist * x_dist + y_dist * y_dist;
+            float factor = 0.f;
+            if (adjust_by_size) {
+                float distance = sqrtf(distance2) - si - tile_size[k];
+                if (distance > 0.f) {
+                    factor = coefficient * mi * tile_mass[k] / (distance * distance);
+                } else if (distance < 0.f) {
+                    factor = 100.f * coefficient * mi * tile_mass[k];
+                }
+            } else if (distance2 > 0.f) {
+                factor = coefficient * mi * tile_mass[k] / distance2;
+            }
+            fx += x_dist * factor;
+            fy += y_dist * factor;
+        }
+        __syncthreads();
+    }
+    if (i < n) {
+        dx[i] = fx;
+        dy[i] = fy;
+    }
+}
+"""
+_gpu_kernel = None
+_gpu = None
+
+
+def gpu_available():
+    """
+    Whether the exact repulsion can run on a CUDA device, see gpu_pairwise_repulsion. Looked up on first use only,
+    since asking initialises CUDA.
+    """
+    global _gpu
+    if _gpu is None:
+        _gpu = cupy is not None and cupy.cuda.is_available()
+    return _gpu
+
+
+def gpu_pairwise_repulsion(x, y, mass, node_size, dx, dy, coefficient, adjust_by_size, block_size=256):
+    """
+    Same as pairwise_repulsion on the CUDA device, in single precision. Only the n inputs and the n forces cross
+    the bus, the n * n interactions stay on the device.
+    """
+    global _gpu_kernel
+    if _gpu_kernel is None:
+        _gpu_kernel = cupy.RawKernel(_GPU_SOURCE, 'pairwise_repulsion')
+
+    n = x.shape[0]
+    if n == 0:
+        return
+    device = tuple(cupy.asarray(array, dtype=cupy.float32) for array in (x, y, mass, node_size))
+    force_x = cupy.empty(n, dtype=cupy.float32)
+    force_y = cupy.empty(n, dtype=cupy.float32)
+    _gpu_kernel(((n + block_size - 1) // block_size,), (block_size,),
+                device + (force_x, force_y, numpy.int32(n), numpy.float32(coefficient), numpy.int32(adjust_by_size)),
+                shared_mem=4 * block_size * numpy.dtype(numpy.float32).itemsize)
+    dx += cupy.asnumpy(force_x)
+    dy += cupy.asnumpy(force_y)
+
+
+@jit()
+def build_quadtree(x, y, mass, leaf_size):
+    """
+    Build the regions breadth first. Each region partitions its range of `indices` in place into contiguous
+    ranges, one per quadrant, which become the ranges of its sub-regions: no allocation happens per region.
+    Regions of at most `leaf_size` nodes are not split.
+    """
+    n = x.shape[0]
+    max_regions = 2 * n + 1  # Every split region has at least two non-empty sub-regions
+
+    indices = numpy.arange(n)
+    buffer = numpy.empty(n, dtype=indices.dtype)
+    quadrant = numpy.empty(n, dtype=numpy.int8)
+    quadrant_count = numpy.zeros(4, dtype=numpy.int64)
+    position = numpy.zeros(4, dtype=numpy.int64)
+
+    first = numpy.zeros(max_regions, dtype=numpy.int64)
+    count = numpy.zeros(max_regions, dtype=numpy.int64)
+    level = numpy.zeros(max_regions, dtype=numpy.int64)
+    center_x = numpy.zeros(max_regions, dtype=numpy.float64)
+    center_y = numpy.zeros(max_regions, dtype=numpy.float64)
+    sum_mass = numpy.zeros(max_regions, dtype=numpy.float64)
+    size2 = numpy.zeros(max_regions, dtype=numpy.float64)
+    children = numpy.full((4, max_regions), -1, dtype=numpy.int32)
+
+    n_regions = 1 if n > 0 else 0
+    count[0] = n
+    depth = 0
+    r = 0
+    while r < n_regions:
+        start = first[r]
+        end = start + count[r]
+
+        region_mass = 0.0
+        sum_x = 0.0
+        sum_y = 0.0
+        for i in range(start, end):
+            node = indices[i]
+            region_mass += mass[node]
+            sum_x += x[node] * mass[node]
+            sum_y += y[node] * mass[node]
+        region_x = sum_x / region_mass
+        region_y = sum_y / region_mass
+
+        max_distance2 = 0.0
+        for i in range(start, end):
+            node = indices[i]
+            distance2 = (x[node] - region_x) * (x[node] - region_x) + (y[node] - region_y) * (y[node] - region_y)
+            max_distance2 = max(max_distance2, distance2)
+
+        sum_mass[r] = region_mass
+        center_x[r] = region_x
+        center_y[r] = region_y
+        size2[r] = 4 * max_distance2  # Size squared
+
+        if count[r] > leaf_size:
+            # Quadrants 0-3 are NW, NE, SW, SE; every node lands in exactly one of them
+            quadrant_count[:] = 0
+            for i in range(start, end):
+                node = indices[i]
+                if y[node] >= region_y:
+                    q = 1 if x[node] >= region_x else 0
+                else:
+                    q = 3 if x[node] >= region_x else 2
+                quadrant[i] = q
+                quadrant_count[q] += 1
+
+            # Coincident nodes (or nodes too close for the floating point center to separate them)
+            # all fall in one quadrant: the region is not split and stays a leaf
+            if (quadrant_count > 0).sum() > 1:
+                offset = start
+                for q in range(4):
+                    position[q] = offset
+                    offset += quadrant_count[q]
+                for i in range(start, end):
+                    q = quadrant[i]
+                    buffer[position[q]] = indices[i]
+                    position[q] += 1
+                indices[start:end] = buffer[start:end]
+
+                offset = start
+                for q in range(4):
+                    if quadrant_count[q] > 0:
+                        first[n_regions] = offset
+                        count[n_regions] = quadrant_count[q]
+                        level[n_regions] = level[r] + 1
+                        depth = max(depth, level[r] + 1)
+                        children[q, r] = n_regions
+                        n_regions += 1
+                    offset += quadrant_count[q]
+        r += 1
+
+    return (indices, first[:n_regions], count[:n_regions], center_x[:n_regions], center_y[:n_regions],
+            sum_mass[:n_regions], size2[:n_regions], children[:, :n_regions], depth)
+
+
+@jit(parallel=True)
+def bh_apply(x, y, mass, node_size, dx, dy, body_x, body_y, body_mass, body_size, first, count,
+             center_x, center_y, sum_mass, size2, children, theta, coefficient, adjust_by_size, stack_size):
+    """
+    Walk the quadtree once per node with an explicit stack.
+    Each walk only writes the forces of its own node, so the walks are independent.
+    A region is far enough when distance * theta > size, compared squared to avoid a sqrt per visited region.
+    The nodes of a leaf are read from the `body_*` arrays, which hold them contiguously in tree order: the
+    node-to-node loop over a leaf has no indirection and no branch on the node itself (its factor is 0),
+    so it compiles to SIMD instructions.
+    """
+    theta2 = theta * theta
+    for n in prange(x.shape[0]):
+        fx = 0.0
+        fy = 0.0
+        stack = numpy.empty(stack_size, dtype=numpy.int32)
+        stack[0] = 0
+        top = 1
+        while top > 0:
+            top -= 1
+            r = stack[top]
+            x_dist = x[n] - center_x[r]
+            y_dist = y[n] - center_y[r]
+            distance2 = x_dist * x_dist + y_dist * y_dist
+            if count[r] > 1 and distance2 * theta2 > size2[r]:
+                # Far enough: approximate the region by its center of mass
+                if distance2 > 0:
+                    # NB: factor = force / distance
+                    factor = coefficient * mass[n] * sum_mass[r] / distance2
+                    fx += x_dist * factor
+                    fy += y_dist * factor
+            elif children[0, r] < 0 and children[1, r] < 0 and children[2, r] < 0 and children[3, r] < 0:
+                # Leaf: node-to-node repulsion with each of its nodes
+                for i in range(first[r], first[r] + count[r]):
+                    x_dist = x[n] - body_x[i]
+                    y_dist = y[n] - body_y[i]
+                    factor = _node_to_node(x_dist, y_dist, mass[n], body_mass[i], node_size[n], body_size[i],
+                                           coefficient, adjust_by_size)
+                    fx += x_dist * factor
+                    fy += y_dist * factor
+            else:
+                for k in range(4):
+                    child = children[k, r]
+                    if child >= 0:
+                        stack[top] = child
+                        top += 1
+        dx[n] += fx
+        dy[n] += fy
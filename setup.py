@@ -31,17 +31,22 @@ setup(
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
 
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 
+    python_requires='>=3.8',
+
     install_requires=[
-        "networkx>=2.4,<3",
-        "numpy"
+        "networkx>=2.7,<3",
+        "numpy",
+        "scipy"
     ],
 
     extras_require={
         'dev': ['matplotlib'],
+        'numba': ['numba'],
     },
 )
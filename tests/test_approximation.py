@@ -0,0 +1,77 @@
+import unittest
+
+import numpy
+
+from fa2l.approximation import Quadtree
+from fa2l.force import LinearRepulsion
+from fa2l.structures import NodeArray
+
+
+class SmallLeaves(Quadtree):
+    # Split down to single nodes, so that every branch of the builder is exercised on small inputs
+    leaf_size = 1
+
+
+def make_nodes(x, y):
+    nodes = NodeArray(len(x))
+    nodes.x[:] = x
+    nodes.y[:] = y
+    nodes.mass[:] = 1
+    return nodes
+
+
+class QuadtreeTest(unittest.TestCase):
+
+    def check_tree(self, nodes, tree_class=SmallLeaves):
+        tree = tree_class(nodes)
+        tree.build()
+        n = len(nodes)
+
+        leaves = [r for r in range(len(tree.count)) if (tree.children[:, r] < 0).all()]
+        in_leaves = numpy.concatenate([tree.indices[tree.first[r]:tree.first[r] + tree.count[r]] for r in leaves]
+                                      + [numpy.empty(0, dtype=tree.indices.dtype)])
+        # Every node lands in exactly one leaf
+        numpy.testing.assert_array_equal(numpy.sort(in_leaves), numpy.arange(n))
+
+        for r in range(len(tree.count)):
+            region = tree.indices[tree.first[r]:tree.first[r] + tree.count[r]]
+            self.assertAlmostEqual(tree.sum_mass[r], nodes.mass[region].sum())
+            for k in range(4):
+                child = tree.children[k, r]
+                if child < 0:
+                    continue
+                # A sub-region is a contiguous part of its parent's range, on the side of the center given by k
+                self.assertGreaterEqual(tree.first[child], tree.first[r])
+                self.assertLessEqual(tree.first[child] + tree.count[child], tree.first[r] + tree.count[r])
+                members = tree.indices[tree.first[child]:tree.first[child] + tree.count[child]]
+                north = nodes.y[members] >= tree.center_y[r]
+                east = nodes.x[members] >= tree.center_x[r]
+                self.assertTrue((north == (k < 2)).all())
+                self.assertTrue((east == (k % 2 == 1)).all())
+        return tree
+
+    def test_random(self):
+        rng = numpy.random.default_rng(0)
+        self.check_tree(make_nodes(rng.normal(size=500), rng.normal(size=500)))
+        self.check_tree(make_nodes(rng.normal(size=500), rng.normal(size=500)), Quadtree)
+
+    def test_empty_and_single(self):
+        self.check_tree(make_nodes([], []))
+        self.check_tree(make_nodes([3.], [4.]))
+
+    def test_on_axis(self):
+        # The center of mass is the origin and every node lies on one of its axes
+        self.check_tree(make_nodes([0., 1., -1., 0., 0., 2., -2., 0., 0.], [0., 0., 0., 1., -1., 0., 0., 2., -2.]))
+        self.check_tree(make_nodes(numpy.zeros(40), numpy.arange(40.)))
+
+    def test_coincident(self):
+        nodes = make_nodes(numpy.ones(50), numpy.ones(50))
+        tree = self.check_tree(nodes)
+        self.assertEqual(len(tree.count), 1)
+
+        tree.apply_force(LinearRepulsion(2.0), 1.2)
+        self.assertTrue(numpy.isfinite(nodes.dx).all() and numpy.isfinite(nodes.dy).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import math
+import unittest
+
+import numpy
+
+from fa2l.force import LinAttraction, LinAttractionAntiCollision, LinAttractionDegreeDistributedAntiCollision, \
+    LinAttractionMassDistributed, LogAttraction, LogAttractionAntiCollision, LogAttractionDegreeDistributed, \
+    LogAttractionDegreeDistributedAntiCollision
+from fa2l.structures import EdgeArray, NodeArray
+
+
+# Per-edge attraction factors (force / distance) of every model, as in the original node by node implementation
+def linear(c, w, d, mass1, weight1):
+    return -c * w
+
+
+def lin_mass_distributed(c, w, d, mass1, weight1):
+    return -c * w / weight1
+
+
+def lin_anti_collision(c, w, d, mass1, weight1):
+    return -c * w if d > 0 else 0.
+
+
+def lin_degree_distributed_anti_collision(c, w, d, mass1, weight1):
+    return -c * w / mass1 if d > 0 else 0.
+
+
+def logarithmic(c, w, d, mass1, weight1):
+    return -c * w * math.log(1 + d) / d if d > 0 else 0.
+
+
+def log_degree_distributed(c, w, d, mass1, weight1):
+    return -c * w * math.log(1 + d) / d / mass1 if d > 0 else 0.
+
+
+MODELS = [
+    # (class, factor, whether the distance is measured between the node borders)
+    (LinAttraction, linear, False),
+    (LinAttractionMassDistributed, lin_mass_distributed, False),
+    (LinAttractionAntiCollision, lin_anti_collision, True),
+    (LinAttractionDegreeDistributedAntiCollision, lin_degree_distributed_anti_collision, True),
+    (LogAttraction, logarithmic, False),
+    (LogAttractionDegreeDistributed, log_degree_distributed, False),
+    (LogAttractionAntiCollision, logarithmic, True),
+    (LogAttractionDegreeDistributedAntiCollision, log_degree_distributed, True),
+]
+
+
+def make_graph(n=60, m=200, seed=0):
+    rng = numpy.random.default_rng(seed)
+    nodes = NodeArray(n)
+    nodes.x[:] = rng.random(n) * 100
+    nodes.y[:] = rng.random(n) * 100
+    nodes.mass[:] = 1 + rng.integers(0, 5, n)
+    nodes.weight[:] = 1 + rng.random(n)
+    edges = EdgeArray(m)
+    edges.node1[:] = rng.integers(0, n // 2, m)
+    edges.node2[:] = rng.integers(n // 2, n, m)
+    edges.weight[:] = rng.random(m)
+    return nodes, edges
+
+
+def reference(nodes, edges, edge_weight, coefficient, factor, by_border):
+    dx = numpy.zeros(len(nodes))
+    dy = numpy.zeros(len(nodes))
+    for k in range(len(edges)):
+        n1, n2 = edges.node1[k], edges.node2[k]
+        x_dist = float(nodes.x[n1]) - float(nodes.x[n2])
+        y_dist = float(nodes.y[n1]) - float(nodes.y[n2])
+        distance = math.sqrt(x_dist * x_dist + y_dist * y_dist)
+        if by_border:
+            distance -= float(nodes.size[n1]) + float(nodes.size[n2])
+        f = factor(coefficient, edge_weight[k], distance, float(nodes.mass[n1]), float(nodes.weight[n1]))
+        dx[n1] += x_dist * f
+        dy[n1] += y_dist * f
+        dx[n2] -= x_dist * f
+        dy[n2] -= y_dist * f
+    return dx, dy
+
+
+class AttractionTest(unittest.TestCase):
+
+    def test_apply_all(self):
+        nodes, edges = make_graph()
+        edge_weight = edges.weight ** 0.5
+        for force_class, factor, by_border in MODELS:
+            force = force_class(1.5)
+            force.prepare(nodes, edges, edge_weight)
+            # Prepared once, then applied to moving nodes as in the layout loop
+            for _ in range(2):
+                nodes.x *= 1.5
+                nodes.dx[:] = 0
+                nodes.dy[:] = 0
+                force.apply_all(nodes, edges, edge_weight)
+
+                expected_dx, expected_dy = reference(nodes, edges, edge_weight, 1.5, factor, by_border)
+                numpy.testing.assert_allclose(nodes.dx, expected_dx, rtol=1e-4, atol=1e-3,
+                                              err_msg=force_class.__name__)
+                numpy.testing.assert_allclose(nodes.dy, expected_dy, rtol=1e-4, atol=1e-3,
+                                              err_msg=force_class.__name__)
+
+
+if __name__ == '__main__':
+    unittest.main()
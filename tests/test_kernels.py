@@ -0,0 +1,57 @@
+import unittest
+
+import numpy
+
+from fa2l import kernels
+from fa2l.force import LinearRepulsion, LinRepulsionAntiCollision
+from fa2l.structures import NodeArray
+
+
+def make_nodes(n, seed=0):
+    rng = numpy.random.default_rng(seed)
+    nodes = NodeArray(n)
+    nodes.x[:] = rng.random(n) * 1000
+    nodes.y[:] = rng.random(n) * 1000
+    nodes.mass[:] = 1 + rng.integers(0, 5, n)
+    return nodes
+
+
+def pairwise(nodes, force):
+    dx = numpy.zeros(len(nodes))
+    dy = numpy.zeros(len(nodes))
+    kernels.pairwise_repulsion(nodes.x.astype(numpy.float64), nodes.y.astype(numpy.float64),
+                               nodes.mass.astype(numpy.float64), nodes.size.astype(numpy.float64), dx, dy,
+                               force.coefficient, force.adjust_by_size)
+    return dx, dy
+
+
+class RepulsionTest(unittest.TestCase):
+
+    def check(self, nodes, force, dx, dy):
+        expected_dx, expected_dy = pairwise(nodes, force)
+        scale = max(numpy.abs(expected_dx).max(initial=0), numpy.abs(expected_dy).max(initial=0), 1)
+        numpy.testing.assert_allclose(dx, expected_dx, rtol=0, atol=1e-2 * scale)
+        numpy.testing.assert_allclose(dy, expected_dy, rtol=0, atol=1e-2 * scale)
+
+    def test_tiled(self):
+        for force_class in (LinearRepulsion, LinRepulsionAntiCollision):
+            for n in (0, 1, 7, 300):
+                nodes = make_nodes(n)
+                force = force_class(2.0)
+                force.tile_size = 64  # Several tiles on and off the diagonal
+                force._apply_tiled(nodes)
+                self.check(nodes, force, nodes.dx, nodes.dy)
+
+    @unittest.skipUnless(kernels.gpu_available(), "needs cupy and a CUDA device")
+    def test_gpu(self):
+        for force_class in (LinearRepulsion, LinRepulsionAntiCollision):
+            for n in (1, 7, 300, 1000):
+                nodes = make_nodes(n)
+                force = force_class(2.0)
+                kernels.gpu_pairwise_repulsion(nodes.x, nodes.y, nodes.mass, nodes.size, nodes.dx, nodes.dy,
+                                               force.coefficient, force.adjust_by_size)
+                self.check(nodes, force, nodes.dx, nodes.dy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import itertools
+import unittest
+
+import networkx
+import numpy
+
+from fa2l import force_atlas2_layout
+
+
+class LayoutTest(unittest.TestCase):
+
+    def check_positions(self, graph, positions):
+        self.assertEqual(set(positions), set(graph.nodes()))
+        for x, y in positions.values():
+            self.assertIsInstance(x, float)
+            self.assertIsInstance(y, float)
+            self.assertTrue(numpy.isfinite(x) and numpy.isfinite(y))
+
+    def test_options(self):
+        graph = networkx.karate_club_graph()
+        for lin_log, outbound, overlapping, strong_gravity, barnes_hut, influence in itertools.product(
+                (False, True), (False, True), (False, True), (False, True), (False, True), (0, 1, 0.5)):
+            with numpy.errstate(all='raise'):
+                positions = force_atlas2_layout(graph, iterations=20, lin_log_mode=lin_log,
+                                                outbound_attraction_distribution=outbound,
+                                                prevent_overlapping=overlapping, strong_gravity_mode=strong_gravity,
+                                                barnes_hut_optimize=barnes_hut, edge_weight_influence=influence)
+            self.check_positions(graph, positions)
+
+    def test_nodes_move(self):
+        graph = networkx.karate_club_graph()
+        start = {node: (float(node % 6), float(node // 6)) for node in graph}
+        for overlapping, barnes_hut in itertools.product((False, True), (False, True)):
+            positions = force_atlas2_layout(graph, pos_list=start, iterations=10, prevent_overlapping=overlapping,
+                                            barnes_hut_optimize=barnes_hut)
+            moved = [numpy.hypot(positions[node][0] - start[node][0], positions[node][1] - start[node][1])
+                     for node in graph]
+            self.assertGreater(min(moved), 0)
+
+    def test_single_node(self):
+        graph = networkx.empty_graph(1)
+        for position in ((0., 0.), (.3, .7), (2., -1.)):
+            for barnes_hut in (False, True):
+                positions = force_atlas2_layout(graph, pos_list={0: position}, iterations=10,
+                                                barnes_hut_optimize=barnes_hut)
+                self.check_positions(graph, positions)
+
+    def test_edgeless(self):
+        graph = networkx.empty_graph(5)
+        for overlapping, barnes_hut in itertools.product((False, True), (False, True)):
+            positions = force_atlas2_layout(graph, iterations=10, prevent_overlapping=overlapping,
+                                            barnes_hut_optimize=barnes_hut)
+            self.check_positions(graph, positions)
+
+
+if __name__ == '__main__':
+    unittest.main()